@@ -1,20 +1,86 @@
+import os
 import cv2
 import numpy as np
 import socket
+try:
+    from tflite_runtime.interpreter import Interpreter  # Small interpreter-only package
+except ImportError:
+    import tensorflow as tf
+    Interpreter = tf.lite.Interpreter  # Same interpreter from the full TensorFlow install
+try:
+    from numba import njit  # JIT compiler for the per-frame preprocessing
+except ImportError:
+    njit = None  # Fall back to NumPy ufuncs writing into preallocated buffers
 
 # ESP32 Camera Configuration
 ESP32_ADDRESS = ("172.20.10.8", 9999)  # Update with correct ESP32 details
 USERNAME = "Yatin"  # ESP32 Authentication Username
 PASSWORD = "210899"  # ESP32 Authentication Password
 
+# Model and Recognition Parameters (classification runs here, the ESP32 only streams frames)
+MODEL = "model_fp32.tflite"  # FP32 TFLite export of the trained model (written by cell 11 of CNN_Training.ipynb)
+CLASS_NAMES = ["Rock", "Paper", "Scissors"]  # Output class names
+THRESHOLD = 128  # Pixels of the averaged 32x32 image at or above this become white
+
 # BMP Frame Specifications
 TOTAL_FRAME_SIZE = 10294  # Total expected size of the BMP frame
-HEADER_LENGTH = 1078  # BMP header length (metadata before pixel data)
-IMAGE_DATA_SIZE = 9216  # Size of pixel data
+HEADER_LENGTH = 1078  # BMP header length (metadata before pixel data), sent once per connection
+IMAGE_DATA_SIZE = 9216  # Size of pixel data, sent for every frame
 FRAME_DIMENSIONS = (96, 96)  # Image dimensions (Height, Width)
 
+def receive_into(view):
+    """Fill a memoryview from the socket. Returns the number of bytes received, short only if the connection was lost."""
+    received = 0
+    while received < len(view):
+        count = client_socket.recv_into(view[received:])  # Receive data chunk into the buffer
+        if not count:  # Check for disconnection
+            print("Connection lost.")
+            break
+        received += count
+    return received
+
+if njit:
+    @njit(cache=True)
+    def resize_threshold(src, dst, threshold):
+        """Average each 3x3 block of the 96x96 src image into the 32x32 dst image, then threshold it."""
+        limit = threshold * 9  # Comparing the block sum saves dividing by 9
+        for out_y in range(32):
+            y = out_y * 3
+            for out_x in range(32):
+                x = out_x * 3
+                block_sum = np.int64(0)  # One integer type for the accumulator, the uint8 pixels are widened to it
+                for dy in range(3):
+                    row = y + dy
+                    block_sum += np.int64(src[row, x]) + np.int64(src[row, x + 1]) + np.int64(src[row, x + 2])
+                dst[out_y, out_x] = 255 if block_sum >= limit else 0
+else:
+    block_sums = np.empty((32, 32), dtype=np.uint16)  # 3x3 block sums, reused for every frame
+
+    def resize_threshold(src, dst, threshold):
+        """Average each 3x3 block of the 96x96 src image into the 32x32 dst image, then threshold it."""
+        np.sum(src.reshape(32, 3, 32, 3), axis=(1, 3), dtype=np.uint16, out=block_sums)
+        np.greater_equal(block_sums, threshold * 9, out=dst)  # 1 where the block average reaches the threshold
+        np.multiply(dst, 255, out=dst)
+
+# Load Trained Model
+if not os.path.isfile(MODEL):
+    raise SystemExit(f"Model file {MODEL} not found. Export it with cell 11 of CNN_Training.ipynb "
+                     f"and copy it next to this script.")
+interpreter = Interpreter(model_path=MODEL)
+interpreter.allocate_tensors()
+input_index = interpreter.get_input_details()[0]["index"]
+output_index = interpreter.get_output_details()[0]["index"]
+model_input = np.empty((1, 32, 32, 3), dtype=np.float32)  # Model takes 32x32 RGB, the gray image fills all channels
+print("Model Loaded..")
+
+# Preprocessing Buffer. With Numba, resize_threshold is compiled here so the JIT delay does not hit the first frame
+resized = np.empty((32, 32), dtype=np.uint8)  # 32x32 thresholded image, refilled for every frame
+resize_threshold(np.zeros(FRAME_DIMENSIONS, dtype=np.uint8)[::-1], resized, THRESHOLD)  # Same array layout as the flipped frames
+
 # Establish TCP Connection to ESP32 Camera
 client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  # Create a TCP socket
+client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 65536)  # Room for several frames in the kernel buffer
+client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Don't hold back small segments (Nagle)
 client_socket.connect(ESP32_ADDRESS)  # Connect to ESP32 at specified IP and Port
 
 # Authentication Request
@@ -25,26 +91,43 @@ client_socket.sendall(login_payload.encode())  # Send authentication request to
 cv2.namedWindow("ESP32 Feed", cv2.WINDOW_NORMAL)  # Create a resizable window
 cv2.resizeWindow("ESP32 Feed", 400, 400)  # Set initial window size
 
+# Frame Buffer (allocated once and filled in place for every frame)
+frame_buffer = bytearray(TOTAL_FRAME_SIZE)
+frame_view = memoryview(frame_buffer)
+pixel_view = frame_view[HEADER_LENGTH:]
+# NumPy view of the pixel data, flipped because BMP stores images bottom-up. recv_into updates it in place.
+frame_matrix = np.frombuffer(frame_buffer, dtype=np.uint8, count=IMAGE_DATA_SIZE,
+                             offset=HEADER_LENGTH).reshape(FRAME_DIMENSIONS)[::-1]
+
+# The BMP header is identical for every frame, so the ESP32 only sends it once.
+# Keeping it at the front of the frame buffer means the buffer always holds a complete BMP.
+# Without a complete header the pixel data that follows would be misaligned, so give up on the stream.
+if receive_into(frame_view[:HEADER_LENGTH]) != HEADER_LENGTH:
+    print("Incomplete BMP header received. Closing connection.")
+    cv2.destroyAllWindows()
+    client_socket.close()
+    raise SystemExit(1)
+
 while True:
     try:
-        # Receive BMP frame data from ESP32
-        frame_buffer = bytearray()  # Initialize an empty buffer
-        while len(frame_buffer) < TOTAL_FRAME_SIZE:  # Ensure the complete frame is received
-            segment = client_socket.recv(TOTAL_FRAME_SIZE - len(frame_buffer))  # Receive data chunk
-            if not segment:  # Check for disconnection
-                print("Connection lost.")
-                break
-            frame_buffer.extend(segment)  # Append received data to the buffer
-
-        # Validate if complete frame is received
-        if len(frame_buffer) != TOTAL_FRAME_SIZE:
-            print(f"Incomplete frame received ({len(frame_buffer)} bytes). Retrying...")
-            continue  # Skip frame processing and retry
-
-        # Extract and process image data
-        grayscale_data = frame_buffer[HEADER_LENGTH:HEADER_LENGTH + IMAGE_DATA_SIZE]  # Extract pixel data
-        frame_matrix = np.frombuffer(grayscale_data, dtype=np.uint8).reshape(FRAME_DIMENSIONS)  # Convert to NumPy array
-        frame_matrix = np.flipud(frame_matrix)  # Adjust BMP orientation (BMP stores images bottom-up)
+        # Receive the pixel data of the next frame from ESP32
+        received = receive_into(pixel_view)
+
+        # Validate if complete frame is received. receive_into only comes back short when the
+        # connection is lost, so there is nothing left to retry.
+        if received != IMAGE_DATA_SIZE:
+            print(f"Incomplete frame received ({received} bytes). Stopping.")
+            break
+
+        # 📏 Resize to 32x32 by averaging each 3x3 block, then threshold
+        resize_threshold(frame_matrix, resized, THRESHOLD)
+        np.copyto(model_input[0], resized[:, :, np.newaxis])
+
+        # 🔮 Run Model Inference
+        interpreter.set_tensor(input_index, model_input)
+        interpreter.invoke()
+        probabilities = interpreter.get_tensor(output_index)[0]
+        print(f"🖼️ Classified as: {CLASS_NAMES[int(np.argmax(probabilities))]}")
 
         # Display the image using OpenCV
         cv2.imshow("ESP32 Feed", frame_matrix)  # Show the live frame
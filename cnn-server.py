@@ -2,17 +2,11 @@ import esp  # ESP-specific module
 from Wifi import Sta  # WiFi connection handler
 import socket as soc  # Socket for TCP communication
 import camera  # Camera module
-from time import sleep  # Sleep function for delays
-from camera import Camera, PixelFormat, FrameSize  # Camera settings
-from image_preprocessing import resize_96x96_to_32x32_averaged_and_threshold  # Image preprocessing function
-import emlearn_cnn_fp32 as emlearn_cnn  # Machine learning model handler
-import gc  # Garbage collector for memory management
-import array  # Array module for efficient data storage
+from camera import Camera, GrabMode, PixelFormat, FrameSize  # Camera settings
 
-# Model and Recognition Parameters
-MODEL = 'model.tmdl'  # Path to the trained model
-RECOGNITION_THRESHOLD = 0.74  # Confidence threshold for classification
-CLASS_NAMES = ["Rock", "Paper", "Scissors"]  # Output class names
+# Frame Parameters (preprocessing and classification run on the client)
+BMP_HEADER_SIZE = const(1078)  # Bitmap headers and palette in front of the 96x96 pixel data
+DEBUG = const(0)  # Set to 1 to print per-frame debug information over the serial port
 
 # Camera Configuration Parameters
 CAMERA_PARAMETERS = {
@@ -27,15 +21,15 @@ CAMERA_PARAMETERS = {
     "powerdown_pin": -1,  # No power down pin
     "reset_pin": -1,  # No reset pin
     "frame_size": FrameSize.R96X96,  # Capture resolution: 96x96
-    "pixel_format": PixelFormat.GRAYSCALE  
+    "pixel_format": PixelFormat.GRAYSCALE,
+    "fb_count": 2,  # Double buffer: the camera DMA fills one frame buffer while the other is processed
+    "grab_mode": GrabMode.LATEST  # Always hand out the most recent complete frame
 }
 
-def argmax(arr):
-    """Returns the index of the max value in an array."""
-    return max(range(len(arr)), key=lambda i: arr[i])
-
 def debug_data(data, label, sample_size=10):
     """Print debugging information about a data object."""
+    if not DEBUG:
+        return
     print(f"🔍 DEBUG: {label} → Type: {type(data)}, Length: {len(data)}, Sample: {data[:sample_size]}")
     
 esp.osdebug(None)  # Disable debug logging from ESP
@@ -43,20 +37,13 @@ esp.osdebug(None)  # Disable debug logging from ESP
 # Authentication Credentials
 UID = const('Yatin')  # Username for authentication
 PWD = const('210899')  # Password for authentication
+AUTH_REQUEST = b"GET /" + UID.encode() + b"/" + PWD.encode() + b" "  # Expected start of the client request
 
 # Initialize and Configure Camera
 cam = Camera(**CAMERA_PARAMETERS)  # Initialize camera with defined parameters
 cam.init()  # Start the camera
 print("Camera Initialized")
 
-# Load Trained Model
-with open(MODEL, 'rb') as f:
-    model_data = array.array('B', f.read())  # Read model data into an array
-    print("Model Data Loaded..")
-    gc.collect()  # Run garbage collector to free memory
-    model = emlearn_cnn.new(model_data)  # Load model into inference engine
-    print("Model Loaded..")
-
 # Setup WiFi Connection
 sta = Sta()  # WiFi client instance
 sta.wlan.disconnect()  # Ensure previous connections are terminated
@@ -83,53 +70,39 @@ print(f"Server listening on {addr}")
 
 while True:
     client_socket, client_address = server_socket.accept()  # Accept incoming client connection
+    client_socket.setsockopt(soc.IPPROTO_TCP, soc.TCP_NODELAY, 1)  # Send each frame without Nagle delay
     print(f"Connection from: {client_address}")
     
     # Authenticate Client
-    request = client_socket.recv(200).decode()  # Receive authentication request
-    try:
-        _, uid, pwd = request.split("\r\n")[0].split()[1].split("/")  # Extract credentials
-        if not (uid == UID and pwd == PWD):
-            print("Unauthorized client. Closing connection.")
-            client_socket.close()
-            continue
-    except:
-        print("Invalid authentication format.")
+    request = client_socket.recv(200)  # Receive authentication request
+    if not request.startswith(AUTH_REQUEST):  # Compare the raw bytes, no decoding or splitting
+        print("Unauthorized client. Closing connection.")
         client_socket.close()
         continue
     
     print("Client authenticated.")
-    probabilities = array.array("f", (0.0 for _ in range(len(CLASS_NAMES))))  # Initialize probability array
+
+    # The bitmap header is the same for every frame, so send it once and only pixel data after that
+    try:
+        client_socket.sendall(cam.capture()[:BMP_HEADER_SIZE])
+    except Exception as e:
+        print(f"Transmission error: {e}")
+        client_socket.close()
+        continue
     
-    # Start Sending JPEG Frames and Predictions
+    # Start Sending Frames
+    # There is no delay between frames: sendall blocks while the client's TCP window is full,
+    # so the loop runs as fast as the camera and the client allow.
     while True:
         try:
-            img_data = cam.capture()  # Capture JPEG image
-            if img_data:
-                client_socket.sendall(img_data)  # Send JPEG frame to client
-                debug_data(img_data, "Captured Image (JPEG)")
-
-                # Ensure it's a bytearray (convert from memoryview)
-                img_data = bytearray(img_data)
-                debug_data(img_data, "Captured Image (Converted to bytearray)")
-
-                # 📏 Resize and Threshold
-                img_32x32 = resize_96x96_to_32x32_averaged_and_threshold(img_data, threshold=128)
-                debug_data(img_32x32, "Resized 32x32 Image")
-
-                # ✅ Convert bytearray to array.array('B', ..)
-                img_32x32_array = array.array('B', img_32x32)
-                debug_data(img_32x32_array, "Converted to array.array('B', ..)")
-
-                # 🔮 Run Model Inference
-                model.run(img_32x32_array, probabilities)  # Perform inference
-                predicted_class = argmax(probabilities)  # Get predicted class index
-                
-                # 📡 Send classification result to client
-                client_socket.sendall(f"PREDICTION: {CLASS_NAMES[predicted_class]}\n".encode())
-                print(f"🖼️ Classified as: {CLASS_NAMES[predicted_class]}")
-                
-                sleep(3)  # Delay between frames (adjust as needed)
+            img_data = cam.capture()  # Capture grayscale BMP frame (memoryview into the camera frame buffer)
+            if not img_data:
+                continue
+
+            # 📡 Send the frame's pixel data straight from the memoryview, the client resizes and classifies it
+            client_socket.sendall(img_data[BMP_HEADER_SIZE:])
+            if DEBUG:
+                debug_data(img_data, "Captured Image (BMP)")
         except Exception as e:
             print(f"Transmission error: {e}")  # Handle errors
             client_socket.close()  # Close connection on error
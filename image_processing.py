@@ -16,31 +16,120 @@ You can experiment with this module, by running the socket_server.py Python scri
 
 '''
 
-from array import array
-import math
-
-# This reduces a 96x96 bitmap to 32x32 and applies a threshold conversion to it, converting
-# Any pixels greater than or equal to the threshold will become white, while any images less than
-# the threshold become black. This makes the image simpler for training a neural network
-# altough obviously some accuracy is lost.
-# setting the inversion parameter to True will reverse the black and white
-# specifying a threshold < 0 will prevent the threshold from being applied and image
-# will be full grayscale, not monochrome
-# note that the bmp_data_mv parameter includes the bitmap headers
-
-
-def resize_96x96_to_32x32_and_threshold(bmp_data_mv, threshold, inversion = False):
-
-    bmp_data = bytearray(bmp_data_mv)
-    OLD_WIDTH = 96
-    OLD_HEIGHT = 96
+import struct
+
+try:
+    import micropython  # Native code emitters, only present on the ESP-32
+except ImportError:
+    micropython = None
+
+try:
+    import numpy as np  # Vectorized versions of the pixel loops when running on a PC
+except ImportError:
+    np = None
+
+try:
+    from numba import njit  # Compiles the NumPy pixel kernels to machine code
+except ImportError:
+    njit = None
+
+# Layout of the 14 byte file header followed by the 40 byte DIB header, little endian, so both headers of a new
+# bitmap are written with one pack_into call. MicroPython's struct has no Struct class, hence the format string.
+_BMP_HEADER_FORMAT = '<2sIHHIIIIHHIIIIII'
+
+# Both the 96x96 source and the 32x32 destination bitmaps are 8 bit with a 256 color palette, so their pixel data
+# starts at the same offset, after the file header, the DIB header and the palette.
+_BMP_HEADER_SIZE = 14
+_DIB_HEADER_SIZE = 40
+_PALETTE_SIZE = 256 * 4
+_PIXEL_DATA_OFFSET = _BMP_HEADER_SIZE + _DIB_HEADER_SIZE + _PALETTE_SIZE
+
+# Look up table that leaves every gray level as it is
+_IDENTITY_LUT = bytes(range(256))
+
+# Pixel kernels for the NumPy paths. Each takes the pixels of a 96x96 source bitmap as a top-down 2D uint8
+# array and returns the 32x32 result. With Numba they are compiled loops, otherwise vectorized NumPy expressions.
+
+if njit is not None:
+    @njit(cache=True)
+    def _downsample_lut(old, lut):
+        new = np.empty((32, 32), dtype=np.uint8)
+        for y in range(32):
+            for x in range(32):
+                new[y, x] = lut[old[y * 3, x * 3]]
+        return new
+
+    @njit(cache=True)
+    def _downsample_avg_thresh(old, threshold, inversion):
+        limit = threshold * 9
+        new = np.empty((32, 32), dtype=np.uint8)
+        for y in range(32):
+            for x in range(32):
+                pixel_sum = 0
+                for dy in range(3):
+                    for dx in range(3):
+                        pixel_sum += old[y * 3 + dy, x * 3 + dx]
+                if inversion:
+                    new[y, x] = 0 if pixel_sum >= limit else 255
+                else:
+                    new[y, x] = 255 if pixel_sum >= limit else 0
+        return new
+
+    # Compile now, for read-only and writable inputs, rather than on the first image
+    _lut = np.frombuffer(_IDENTITY_LUT, dtype=np.uint8)
+    for _old in (np.zeros((96, 96), dtype=np.uint8)[::-1], np.frombuffer(bytes(96 * 96), dtype=np.uint8).reshape(96, 96)[::-1]):
+        _downsample_lut(_old, _lut)
+        _downsample_avg_thresh(_old, 0, False)
+    del _old, _lut
+
+elif np is not None:
+    def _downsample_lut(old, lut):
+        return lut[old[::3, ::3]]
+
+    def _downsample_avg_thresh(old, threshold, inversion):
+        block_sums = old.reshape(32, 3, 32, 3).sum(axis=(1, 3), dtype=np.uint16)  # uint16 holds 9 * 255
+        return np.where(block_sums >= threshold * 9, 0 if inversion else 255, 255 if inversion else 0).astype(np.uint8)
+
+# Takes every 3rd pixel of every 3rd row of a 96x96 8 bit image and maps it through a 256 byte look up
+# table, writing the 32x32 result to dst. As for _average_threshold below, src and dst are raw pixel data
+# with src bottom-up and dst top-down.
+# On the ESP-32 this is compiled to machine code by the viper emitter, on a PC with NumPy it uses
+# the _downsample_lut kernel.
+
+if micropython:
+    @micropython.viper
+    def _sample_lut(src: ptr8, dst: ptr8, lut: ptr8):
+        d = 0
+        y = 31
+        while y >= 0:
+            p = y * 288 + 192  # Top row of each group of 3, i.e. rows 95, 92, ... 2
+            end = p + 96
+            while p < end:
+                dst[d] = lut[src[p]]
+                d += 1
+                p += 3
+            y -= 1
+elif np is not None:
+    def _sample_lut(src, dst, lut):
+        old = np.frombuffer(src, dtype=np.uint8, count=96 * 96).reshape(96, 96)[::-1]
+        np.frombuffer(dst, dtype=np.uint8, count=32 * 32).reshape(32, 32)[:] = \
+            _downsample_lut(old, np.frombuffer(lut, dtype=np.uint8))
+else:
+    def _sample_lut(src, dst, lut):
+        d = 0
+        for y in range(31, -1, -1):
+            # Build each output row with one slice assignment
+            row = y * 288 + 192  # Top row of each group of 3, i.e. rows 95, 92, ... 2
+            dst[d:d + 32] = bytes([lut[src[p]] for p in range(row, row + 96, 3)])
+            d += 32
+
+# Builds the bytes of an empty 32x32 8 bit bitmap with both headers filled in. The headers are the same for
+# every image, so this is only done once, at import, and each new bitmap starts as a copy of _NEW_BMP_TEMPLATE.
+
+def _new_bmp_template():
     NEW_WIDTH = 32
     NEW_HEIGHT = 32
 
-    OLD_BMP_HEADER_SIZE = 14
-    OLD_DIB_HEADER_SIZE = 40
-    OLD_PALETTE_SIZE = 256 * 4
-
     NEW_BMP_HEADER_SIZE = 14
     NEW_DIB_HEADER_SIZE = 40
     NEW_PALETTE_SIZE = 256 * 4
@@ -55,52 +144,67 @@ def resize_96x96_to_32x32_and_threshold(bmp_data_mv, threshold, inversion = Fals
 
     new_bmp_data = bytearray(new_file_size)
 
-    # Copy the palette
-    palette_offset = OLD_BMP_HEADER_SIZE + OLD_DIB_HEADER_SIZE
-    new_palette_offset = NEW_BMP_HEADER_SIZE + NEW_DIB_HEADER_SIZE
-    new_bmp_data[new_palette_offset:new_palette_offset + OLD_PALETTE_SIZE] = \
-        bmp_data[palette_offset:palette_offset + OLD_PALETTE_SIZE]
-
     # Fill headers for the new BMP
-    new_bmp_data[0:2] = b'BM'  # Signature
-    new_bmp_data[2:6] = new_file_size.to_bytes(4, 'little')  # File size
-    new_bmp_data[10:14] = (NEW_BMP_HEADER_SIZE + NEW_DIB_HEADER_SIZE + NEW_PALETTE_SIZE).to_bytes(4, 'little')  # Data offset
-    new_bmp_data[14:18] = NEW_DIB_HEADER_SIZE.to_bytes(4, 'little')  # DIB header size
-    new_bmp_data[18:22] = NEW_WIDTH.to_bytes(4, 'little')  # Width
-    new_bmp_data[22:26] = NEW_HEIGHT.to_bytes(4, 'little')  # Height
-    new_bmp_data[26:28] = b'\x01\x00'  # Planes
-    new_bmp_data[28:30] = b'\x08\x00'  # Bits per pixel
-    new_bmp_data[34:38] = ((NEW_WIDTH + NEW_ROW_PADDING) * NEW_HEIGHT).to_bytes(4, 'little')  # Image size
-
-    old_pixel_data_offset = OLD_BMP_HEADER_SIZE + OLD_DIB_HEADER_SIZE + OLD_PALETTE_SIZE
-    new_pixel_data_offset = NEW_BMP_HEADER_SIZE + NEW_DIB_HEADER_SIZE + NEW_PALETTE_SIZE
-
-    for new_y in range(NEW_HEIGHT):
-        for new_x in range(NEW_WIDTH):
-            # Map new pixel coordinates to old coordinates
-            old_x = (new_x * OLD_WIDTH) // NEW_WIDTH
-            old_y = (new_y * OLD_HEIGHT) // NEW_HEIGHT
-            old_y = OLD_HEIGHT - 1 - old_y  # Reverse the row order
-            old_pixel_offset = old_pixel_data_offset + old_y * (OLD_WIDTH + (OLD_WIDTH % 4)) + old_x
-
-            # Interpret the byte as unsigned (MicroPython handles this automatically)
-            pixel_value = bmp_data[old_pixel_offset] & 0xFF #
-            # Apply threshold if > 0, otherwise just keep all color values.
-            if threshold >= 0:
-                if inversion:
-                    pixel_value = 0 if pixel_value >= threshold else 255
-                else:    
-                    pixel_value = 255 if pixel_value >= threshold else 0
+    struct.pack_into(_BMP_HEADER_FORMAT, new_bmp_data, 0,
+                     b'BM',  # Signature
+                     new_file_size,  # File size
+                     0, 0,  # Reserved
+                     NEW_BMP_HEADER_SIZE + NEW_DIB_HEADER_SIZE + NEW_PALETTE_SIZE,  # Data offset
+                     NEW_DIB_HEADER_SIZE,  # DIB header size
+                     NEW_WIDTH,  # Width
+                     NEW_HEIGHT,  # Height
+                     1,  # Planes
+                     8,  # Bits per pixel
+                     0,  # Compression
+                     (NEW_WIDTH + NEW_ROW_PADDING) * NEW_HEIGHT,  # Image size
+                     0, 0, 0, 0)  # Resolution and color counts
+
+    return bytes(new_bmp_data)
+
+_NEW_BMP_TEMPLATE = _new_bmp_template()
+
+# Creates a 32x32 8 bit bitmap with the headers filled in and the palette copied from the 96x96 bitmap
+# bmp_data_mv. The pixel data is left for the caller to write.
+
+def _new_bmp_32x32(bmp_data_mv):
+    new_bmp_data = bytearray(_NEW_BMP_TEMPLATE)
 
-            # Write the pixel to the new BMP
-            new_bmp_data[new_pixel_data_offset] = pixel_value
-            new_pixel_data_offset += 1
+    # Copy the palette
+    new_bmp_data[_BMP_HEADER_SIZE + _DIB_HEADER_SIZE:_PIXEL_DATA_OFFSET] = \
+        bmp_data_mv[_BMP_HEADER_SIZE + _DIB_HEADER_SIZE:_PIXEL_DATA_OFFSET]
+
+    return new_bmp_data
 
-        # Handle row padding for the new BMP
-        new_pixel_data_offset += NEW_ROW_PADDING
+# The shared "every 3rd pixel" resize behind the plain, threshold and quantized conversions. Each of them
+# only differs in the look up table that maps a source gray level to the output pixel.
 
+def _resize_96_to_32(bmp_data_mv, lut):
+    new_bmp_data = _new_bmp_32x32(bmp_data_mv)
+    _sample_lut(memoryview(bmp_data_mv)[_PIXEL_DATA_OFFSET:], memoryview(new_bmp_data)[_PIXEL_DATA_OFFSET:], lut)
     return new_bmp_data
 
+# This reduces a 96x96 bitmap to 32x32 and applies a threshold conversion to it, converting
+# Any pixels greater than or equal to the threshold will become white, while any images less than
+# the threshold become black. This makes the image simpler for training a neural network
+# altough obviously some accuracy is lost.
+# setting the inversion parameter to True will reverse the black and white
+# specifying a threshold < 0 will prevent the threshold from being applied and image
+# will be full grayscale, not monochrome
+# note that the bmp_data_mv parameter includes the bitmap headers
+
+
+def resize_96x96_to_32x32_and_threshold(bmp_data_mv, threshold, inversion = False):
+    # Look up table giving the output for each of the 256 gray levels, so there are no branches per pixel.
+    # Apply threshold if > 0, otherwise just keep all color values.
+    if threshold < 0:
+        lut = _IDENTITY_LUT
+    elif inversion:
+        lut = bytes(0 if v >= threshold else 255 for v in range(256))
+    else:
+        lut = bytes(255 if v >= threshold else 0 for v in range(256))
+
+    return _resize_96_to_32(bmp_data_mv, lut)
+
 # Resizes to 32 x 32 and then quantizes the image to have "depth" colors (grayscale).
 # This can simplify the data in an image, but may also cause loss of detail and edges by merging
 # otherwise contrasting lines. 
@@ -108,209 +212,202 @@ def resize_96x96_to_32x32_and_threshold(bmp_data_mv, threshold, inversion = Fals
 def resize_96x96_to_32x32_quantized(bmp_data_mv, depth):
     if depth < 2: #ignore fewer than 2 colors or a negative depth
         depth = 256             
-    bmp_data = bytearray(bmp_data_mv)
-    OLD_WIDTH = 96
-    OLD_HEIGHT = 96
-    NEW_WIDTH = 32
-    NEW_HEIGHT = 32
-
-    OLD_BMP_HEADER_SIZE = 14
-    OLD_DIB_HEADER_SIZE = 40
-    OLD_PALETTE_SIZE = 256 * 4
-
-    NEW_BMP_HEADER_SIZE = 14
-    NEW_DIB_HEADER_SIZE = 40
-    NEW_PALETTE_SIZE = 256 * 4
-    NEW_ROW_PADDING = (NEW_WIDTH % 4)  # Padding for each row
-
-    new_file_size = (
-        NEW_BMP_HEADER_SIZE +
-        NEW_DIB_HEADER_SIZE +
-        NEW_PALETTE_SIZE +
-        (NEW_WIDTH + NEW_ROW_PADDING) * NEW_HEIGHT
-    )
-
-    new_bmp_data = bytearray(new_file_size)
     range_size = 256 // depth
-    
 
-
-
-
-    # Copy the palette
-    palette_offset = OLD_BMP_HEADER_SIZE + OLD_DIB_HEADER_SIZE
-    new_palette_offset = NEW_BMP_HEADER_SIZE + NEW_DIB_HEADER_SIZE
-    new_bmp_data[new_palette_offset:new_palette_offset + OLD_PALETTE_SIZE] = \
-        bmp_data[palette_offset:palette_offset + OLD_PALETTE_SIZE]
-
-    # Fill headers for the new BMP
-    new_bmp_data[0:2] = b'BM'  # Signature
-    new_bmp_data[2:6] = new_file_size.to_bytes(4, 'little')  # File size
-    new_bmp_data[10:14] = (NEW_BMP_HEADER_SIZE + NEW_DIB_HEADER_SIZE + NEW_PALETTE_SIZE).to_bytes(4, 'little')  # Data offset
-    new_bmp_data[14:18] = NEW_DIB_HEADER_SIZE.to_bytes(4, 'little')  # DIB header size
-    new_bmp_data[18:22] = NEW_WIDTH.to_bytes(4, 'little')  # Width
-    new_bmp_data[22:26] = NEW_HEIGHT.to_bytes(4, 'little')  # Height
-    new_bmp_data[26:28] = b'\x01\x00'  # Planes
-    new_bmp_data[28:30] = b'\x08\x00'  # Bits per pixel
-    new_bmp_data[34:38] = ((NEW_WIDTH + NEW_ROW_PADDING) * NEW_HEIGHT).to_bytes(4, 'little')  # Image size
-
-    old_pixel_data_offset = OLD_BMP_HEADER_SIZE + OLD_DIB_HEADER_SIZE + OLD_PALETTE_SIZE
-    new_pixel_data_offset = NEW_BMP_HEADER_SIZE + NEW_DIB_HEADER_SIZE + NEW_PALETTE_SIZE
-
-    for new_y in range(NEW_HEIGHT):
-        for new_x in range(NEW_WIDTH):
-            # Map new pixel coordinates to old coordinates
-            old_x = (new_x * OLD_WIDTH) // NEW_WIDTH
-            old_y = (new_y * OLD_HEIGHT) // NEW_HEIGHT
-            old_y = OLD_HEIGHT - 1 - old_y  # Reverse the row order
-            old_pixel_offset = old_pixel_data_offset + old_y * (OLD_WIDTH + (OLD_WIDTH % 4)) + old_x
-
-            pixel_value = bmp_data[old_pixel_offset] & 0xFF            
-            # Compute the quantized level
-            quantized_level = pixel_value // range_size
-            # Map the quantized level to the center of its range
-            pixel_value = (quantized_level * range_size) + range_size // 2   
-            # Write the pixel to the new BMP
-            new_bmp_data[new_pixel_data_offset] = pixel_value
-            new_pixel_data_offset += 1
-
-        # Handle row padding for the new BMP
-        new_pixel_data_offset += NEW_ROW_PADDING
-
-    return new_bmp_data
+    # Look up table mapping each gray level to the center of its quantized range (capped at 255 when
+    # depth doesn't divide 256 evenly)
+    half_range = range_size // 2
+    lut = bytes(min((v // range_size) * range_size + half_range, 255) for v in range(256))
+
+    return _resize_96_to_32(bmp_data_mv, lut)
+
+# Averages every 3x3 block of a 96x96 8 bit image and applies a threshold to the average, writing
+# the 32x32 result to dst. Both src and dst are raw pixel data (no bitmap headers). The rows of src
+# are bottom-up as stored in the bitmap, the rows written to dst are top-down.
+# Comparing the block sum against threshold * 9 is the same as comparing the average against the
+# threshold, so no division is needed.
+# On the ESP-32 this is compiled to machine code by the viper emitter, on a PC with NumPy it uses
+# the _downsample_avg_thresh kernel.
+
+if micropython:
+    @micropython.viper
+    def _average_threshold(src: ptr8, dst: ptr8, threshold: int, inversion: int):
+        limit = threshold * 9
+        high = 255
+        low = 0
+        if inversion:
+            high = 0
+            low = 255
+        d = 0
+        y = 31
+        while y >= 0:
+            row = y * 288  # 3 rows of 96 pixels per block
+            x = 0
+            while x < 96:
+                p = row + x
+                s = src[p] + src[p + 1] + src[p + 2]
+                p += 96
+                s += src[p] + src[p + 1] + src[p + 2]
+                p += 96
+                s += src[p] + src[p + 1] + src[p + 2]
+                if s >= limit:
+                    dst[d] = high
+                else:
+                    dst[d] = low
+                d += 1
+                x += 3
+            y -= 1
+elif np is not None:
+    def _average_threshold(src, dst, threshold, inversion):
+        old = np.frombuffer(src, dtype=np.uint8, count=96 * 96).reshape(96, 96)[::-1]
+        np.frombuffer(dst, dtype=np.uint8, count=32 * 32).reshape(32, 32)[:] = \
+            _downsample_avg_thresh(old, threshold, inversion)
+else:
+    def _average_threshold(src, dst, threshold, inversion):
+        limit = threshold * 9
+        high, low = (0, 255) if inversion else (255, 0)
+        d = 0
+        for y in range(31, -1, -1):
+            # The 3 source rows of this row of blocks, sliced once and shared by all 32 blocks
+            row = y * 288  # 3 rows of 96 pixels per block
+            row_a = src[row:row + 96]
+            row_b = src[row + 96:row + 192]
+            row_c = src[row + 192:row + 288]
+            for c in range(0, 96, 3):
+                pixel_sum = (row_a[c] + row_a[c + 1] + row_a[c + 2] +
+                             row_b[c] + row_b[c + 1] + row_b[c + 2] +
+                             row_c[c] + row_c[c + 1] + row_c[c + 2])
+                dst[d] = high if pixel_sum >= limit else low
+                d += 1
 
 # Resizes to 32 x 32 and then makes the image black and white by applying thresholding.
 # Any pixels with value below the threshold will be 0 (black) and any others will be 255 (white).
 # If inversion is True, then the colors are inverted so that values below the threshold become 255 (white) etc.
+# If an out buffer of 32 * 32 bytes is given, only the pixel data is written into it (no bitmap headers)
+# and out is returned, so a caller processing frames in a loop can reuse the same buffer every time.
+# bmp_data_mv is only read, never copied or modified, so the memoryview returned by the camera can be passed as is.
 
-def resize_96x96_to_32x32_averaged_and_threshold(bmp_data_mv, threshold, inversion=False):
-    bmp_data = bytearray(bmp_data_mv)
-    OLD_WIDTH = 96
-    OLD_HEIGHT = 96
-    NEW_WIDTH = 32
-    NEW_HEIGHT = 32
+def resize_96x96_to_32x32_averaged_and_threshold(bmp_data_mv, threshold, inversion=False, out=None):
+    if out is not None:
+        _average_threshold(memoryview(bmp_data_mv)[_PIXEL_DATA_OFFSET:], out, threshold, inversion)
+        return out
 
-    OLD_BMP_HEADER_SIZE = 14
-    OLD_DIB_HEADER_SIZE = 40
-    OLD_PALETTE_SIZE = 256 * 4
+    new_bmp_data = _new_bmp_32x32(bmp_data_mv)
 
-    NEW_BMP_HEADER_SIZE = 14
-    NEW_DIB_HEADER_SIZE = 40
-    NEW_PALETTE_SIZE = 256 * 4
-    NEW_ROW_PADDING = (NEW_WIDTH % 4)  # Padding for each row
-
-    new_file_size = (
-        NEW_BMP_HEADER_SIZE +
-        NEW_DIB_HEADER_SIZE +
-        NEW_PALETTE_SIZE +
-        (NEW_WIDTH + NEW_ROW_PADDING) * NEW_HEIGHT
-    )
-
-    new_bmp_data = bytearray(new_file_size)
-
-    # Copy the palette
-    palette_offset = OLD_BMP_HEADER_SIZE + OLD_DIB_HEADER_SIZE
-    new_palette_offset = NEW_BMP_HEADER_SIZE + NEW_DIB_HEADER_SIZE
-    new_bmp_data[new_palette_offset:new_palette_offset + OLD_PALETTE_SIZE] = \
-        bmp_data[palette_offset:palette_offset + OLD_PALETTE_SIZE]
-
-    # Fill headers for the new BMP
-    new_bmp_data[0:2] = b'BM'  # Signature
-    new_bmp_data[2:6] = new_file_size.to_bytes(4, 'little')  # File size
-    new_bmp_data[10:14] = (NEW_BMP_HEADER_SIZE + NEW_DIB_HEADER_SIZE + NEW_PALETTE_SIZE).to_bytes(4, 'little')  # Data offset
-    new_bmp_data[14:18] = NEW_DIB_HEADER_SIZE.to_bytes(4, 'little')  # DIB header size
-    new_bmp_data[18:22] = NEW_WIDTH.to_bytes(4, 'little')  # Width
-    new_bmp_data[22:26] = NEW_HEIGHT.to_bytes(4, 'little')  # Height
-    new_bmp_data[26:28] = b'\x01\x00'  # Planes
-    new_bmp_data[28:30] = b'\x08\x00'  # Bits per pixel
-    new_bmp_data[34:38] = ((NEW_WIDTH + NEW_ROW_PADDING) * NEW_HEIGHT).to_bytes(4, 'little')  # Image size
-
-    old_pixel_data_offset = OLD_BMP_HEADER_SIZE + OLD_DIB_HEADER_SIZE + OLD_PALETTE_SIZE
-    new_pixel_data_offset = NEW_BMP_HEADER_SIZE + NEW_DIB_HEADER_SIZE + NEW_PALETTE_SIZE
-
-    # Resize using pixel averaging
-    scale_factor = OLD_WIDTH // NEW_WIDTH
-    row_stride = OLD_WIDTH + (OLD_WIDTH % 4)
-
-    for new_y in range(NEW_HEIGHT):
-        for new_x in range(NEW_WIDTH):
-            # Compute the block of old pixels to average
-            old_x_start = new_x * scale_factor
-            old_y_start = (NEW_HEIGHT - 1 - new_y) * scale_factor  # Reverse the row order
-            old_x_end = old_x_start + scale_factor
-            old_y_end = old_y_start + scale_factor
-            pixel_sum = 0
-            pixel_count = 0
-
-            for old_y in range(old_y_start, old_y_end):
-                for old_x in range(old_x_start, old_x_end):
-                    old_pixel_offset = old_pixel_data_offset + old_y * row_stride + old_x
-                    pixel_sum += bmp_data[old_pixel_offset]
-                    pixel_count += 1
-
-            # Average the pixel values
-            avg_pixel_value = pixel_sum // pixel_count
-
-            # Apply threshold
-            if inversion:
-                pixel_value = 0 if avg_pixel_value >= threshold else 255
-            else:
-                pixel_value = 255 if avg_pixel_value >= threshold else 0
-
-            # Write the pixel to the new BMP
-            new_bmp_data[new_pixel_data_offset] = pixel_value
-            new_pixel_data_offset += 1
-
-        # Handle row padding for the new BMP
-        new_pixel_data_offset += NEW_ROW_PADDING
+    # Resize using pixel averaging (NEW_ROW_PADDING is 0 for a 32 pixel wide image)
+    _average_threshold(memoryview(bmp_data_mv)[_PIXEL_DATA_OFFSET:],
+                       memoryview(new_bmp_data)[_PIXEL_DATA_OFFSET:],
+                       threshold, inversion)
 
     return new_bmp_data
 
 
 
 
+# The Sobel loop of sobel_edge_detection below for the ESP-32, compiled by the viper emitter so that every
+# pixel is a typed ptr8 load rather than a subscript of a bytearray object. src and dst are the 32x32 pixel data.
+
+if micropython:
+    @micropython.viper
+    def _sobel_edges(src: ptr8, dst: ptr8):
+        # Zero out the edges
+        i = 0
+        while i < 32:
+            dst[i] = 0
+            dst[992 + i] = 0
+            dst[i * 32] = 0
+            dst[i * 32 + 31] = 0
+            i += 1
+        y = 1
+        while y < 31:
+            r0 = (y - 1) * 32
+            r1 = r0 + 32
+            r2 = r1 + 32
+            x = 1
+            while x < 31:
+                p00 = src[r0 + x - 1]
+                p02 = src[r0 + x + 1]
+                p20 = src[r2 + x - 1]
+                p22 = src[r2 + x + 1]
+                sum_x = (p02 - p00) + 2 * (src[r1 + x + 1] - src[r1 + x - 1]) + (p22 - p20)
+                sum_y = (p20 - p00) + 2 * (src[r2 + x] - src[r0 + x]) + (p22 - p02)
+                if sum_x * sum_x + sum_y * sum_y >= 65025:
+                    dst[r1 + x] = 255
+                else:
+                    dst[r1 + x] = 0
+                x += 1
+            y += 1
+
+# True if obj supports the buffer protocol (bytes, bytearray, array('B'), memoryview), and with writable=True
+# only if it can also be written through, which the NumPy and viper kernels need for their output.
+
+def _is_buffer(obj, writable=False):
+    try:
+        view = memoryview(obj)
+    except TypeError:
+        return False
+    return not (writable and getattr(view, 'readonly', False))
+
 #This does Sobel Edge detection (you can look up the algorithm) on an image, copying it into the output image array.
 #Note that the input image may include a bitmap header, in which case the offset parameter should point to
 #The start of the actual pixel data. The output data is an array just big enough to hold the pixel data.
 #Size fixed to 32 x 32.
+#The fast paths need the input to be a buffer and the output a writable buffer (e.g. a bytearray), any other
+#sequences of pixel values, like lists, go through the plain loop.
 
 def sobel_edge_detection(input_image, output_image, offset):
-    # Define flattened Sobel kernels
-    Gx = array('b', [-1,  0,  1, -2,  0,  2, -1,  0,  1])
-    Gy = array('b', [-1, -2, -1,  0,  0,  0,  1,  2,  1])
-    
+    # Same order as the other kernels: viper on the ESP-32 first, then NumPy, then the plain loop
+    buffers = _is_buffer(input_image) and _is_buffer(output_image, writable=True)
+    if micropython and buffers:
+        _sobel_edges(memoryview(input_image)[offset:], output_image)
+        return
+
+    if np is not None and buffers:
+        # Both kernels as sums of shifted views of the image. A magnitude of at least 255 is the
+        # same as a squared magnitude of at least 255 * 255, so no square root is needed.
+        img = np.frombuffer(input_image, dtype=np.uint8, count=32 * 32, offset=offset).reshape(32, 32).astype(np.int32)
+        gx = (img[:-2, 2:] + 2 * img[1:-1, 2:] + img[2:, 2:]) - (img[:-2, :-2] + 2 * img[1:-1, :-2] + img[2:, :-2])
+        gy = (img[2:, :-2] + 2 * img[2:, 1:-1] + img[2:, 2:]) - (img[:-2, :-2] + 2 * img[:-2, 1:-1] + img[:-2, 2:])
+        out = np.frombuffer(output_image, dtype=np.uint8, count=32 * 32).reshape(32, 32)
+        out[:] = 0  # Zero out the edges
+        out[1:-1, 1:-1] = np.where(gx * gx + gy * gy >= 255 * 255, 255, 0)
+        return
+
     # Image dimensions
     width = 32
     height = 32
 
+    # Zero out the edges up front, only the interior is written below
+    for i in range(width):
+        output_image[i] = 0
+        output_image[(height - 1) * width + i] = 0
+        output_image[i * width] = 0
+        output_image[i * width + width - 1] = 0
+
     # Iterate through the image (excluding border pixels)
     for y in range(1, height - 1):
+        # Start of the rows above, at and below the current pixel (adjusted by the offset)
+        r0 = offset + (y - 1) * width
+        r1 = r0 + width
+        r2 = r1 + width
         for x in range(1, width - 1):
-            # Apply Sobel kernels using flattened arrays
-            sum_x = 0
-            sum_y = 0
-            for ky in range(-1, 2):
-                for kx in range(-1, 2):
-                    # Adjust the pixel index by adding the offset
-                    pixel_index = offset + (y + ky) * width + (x + kx)
-                    pixel = input_image[pixel_index]
-                    kernel_index = (ky + 1) * 3 + (kx + 1)  # Index into the 1D kernel
-                    sum_x += pixel * Gx[kernel_index]
-                    sum_y += pixel * Gy[kernel_index]
-                    #print (f"ky is {ky}, kx is {kx} pixel_index is {pixel_index}, pixel = {pixel}, kernel index is {kernel_index} Gx is {pixel * Gx[kernel_index]} sum_x is {sum_x}, sum_y is {sum_y}")
-            # Compute gradient magnitude
-            magnitude = math.sqrt(sum_x**2 + sum_y**2)
-            if magnitude < 255:
-                magnitude = 0
-            # Clamp the magnitude to [0, 255] and store it in the output image
-            output_image[y * width + x] = 0 if magnitude < 255 else 255
-                # Pad the edges with zeroes
-    for y in range(height):
-        for x in range(width):
-            if x == 0 or y == 0 or x == width - 1 or y == height - 1:
-                output_image[y * width + x] = 0  # Zero out the edges
-                
-                
+            # Load the 3x3 neighbourhood once, the centre pixel has a zero weight in both kernels
+            p00 = input_image[r0 + x - 1]
+            p01 = input_image[r0 + x]
+            p02 = input_image[r0 + x + 1]
+            p10 = input_image[r1 + x - 1]
+            p12 = input_image[r1 + x + 1]
+            p20 = input_image[r2 + x - 1]
+            p21 = input_image[r2 + x]
+            p22 = input_image[r2 + x + 1]
+            # Sobel kernels unrolled, Gx = [-1 0 1, -2 0 2, -1 0 1] and Gy = [-1 -2 -1, 0 0 0, 1 2 1],
+            # leaving only the non-zero terms
+            sum_x = (p02 - p00) + 2 * (p12 - p10) + (p22 - p20)
+            sum_y = (p20 - p00) + 2 * (p21 - p01) + (p22 - p02)
+            # A gradient magnitude of at least 255 is a squared magnitude of at least 255 * 255 (65025),
+            # so compare the squares and skip the square root
+            output_image[y * width + x] = 255 if sum_x * sum_x + sum_y * sum_y >= 65025 else 0
+
 
 # This converts a 96 x 96 px bitmap image to a 32 x 32 px bitmap image.
 # It uses very simple "every 3rd pixel" conversion, which is why it is reduced to 32 x 32
@@ -318,70 +415,7 @@ def sobel_edge_detection(input_image, output_image, offset):
 # note that the bmp_data_mv parameter includes the bitmap headers
 
 def resize_96x96_to_32x32(bmp_data_mv):
-
-    bmp_data = bytearray(bmp_data_mv)
-    print(f"bmp_data type is {type(bmp_data)}")
-    OLD_WIDTH = 96
-    OLD_HEIGHT = 96
-    NEW_WIDTH = 32
-    NEW_HEIGHT = 32
-
-    OLD_BMP_HEADER_SIZE = 14
-    OLD_DIB_HEADER_SIZE = 40
-    OLD_PALETTE_SIZE = 256 * 4
-
-    NEW_BMP_HEADER_SIZE = 14
-    NEW_DIB_HEADER_SIZE = 40
-    NEW_PALETTE_SIZE = 256 * 4
-    NEW_ROW_PADDING = (NEW_WIDTH % 4)  # Padding for each row
-
-    new_file_size = (
-        NEW_BMP_HEADER_SIZE +
-        NEW_DIB_HEADER_SIZE +
-        NEW_PALETTE_SIZE +
-        (NEW_WIDTH + NEW_ROW_PADDING) * NEW_HEIGHT
-    )
-
-    new_bmp_data = bytearray(new_file_size)
-
-    # Copy the palette
-    palette_offset = OLD_BMP_HEADER_SIZE + OLD_DIB_HEADER_SIZE
-    new_palette_offset = NEW_BMP_HEADER_SIZE + NEW_DIB_HEADER_SIZE
-    new_bmp_data[new_palette_offset:new_palette_offset + OLD_PALETTE_SIZE] = \
-        bmp_data[palette_offset:palette_offset + OLD_PALETTE_SIZE]
-
-    # Fill headers for the new BMP
-    new_bmp_data[0:2] = b'BM'  # Signature
-    new_bmp_data[2:6] = new_file_size.to_bytes(4, 'little')  # File size
-    new_bmp_data[10:14] = (NEW_BMP_HEADER_SIZE + NEW_DIB_HEADER_SIZE + NEW_PALETTE_SIZE).to_bytes(4, 'little')  # Data offset
-    new_bmp_data[14:18] = NEW_DIB_HEADER_SIZE.to_bytes(4, 'little')  # DIB header size
-    new_bmp_data[18:22] = NEW_WIDTH.to_bytes(4, 'little')  # Width
-    new_bmp_data[22:26] = NEW_HEIGHT.to_bytes(4, 'little')  # Height
-    new_bmp_data[26:28] = b'\x01\x00'  # Planes
-    new_bmp_data[28:30] = b'\x08\x00'  # Bits per pixel
-    new_bmp_data[34:38] = ((NEW_WIDTH + NEW_ROW_PADDING) * NEW_HEIGHT).to_bytes(4, 'little')  # Image size
-
-    old_pixel_data_offset = OLD_BMP_HEADER_SIZE + OLD_DIB_HEADER_SIZE + OLD_PALETTE_SIZE
-    new_pixel_data_offset = NEW_BMP_HEADER_SIZE + NEW_DIB_HEADER_SIZE + NEW_PALETTE_SIZE
-
-    for new_y in range(NEW_HEIGHT):
-        for new_x in range(NEW_WIDTH):
-            # Map new pixel coordinates to old coordinates
-            old_x = (new_x * OLD_WIDTH) // NEW_WIDTH
-            old_y = (new_y * OLD_HEIGHT) // NEW_HEIGHT
-            old_y = OLD_HEIGHT - 1 - old_y  # Reverse the row order
-            old_pixel_offset = old_pixel_data_offset + old_y * (OLD_WIDTH + (OLD_WIDTH % 4)) + old_x
-
-            # Interpret the byte as unsigned (MicroPython handles this automatically)
-            pixel_value = bmp_data[old_pixel_offset] & 0xFF #
-            # Write the pixel to the new BMP
-            new_bmp_data[new_pixel_data_offset] = pixel_value
-            new_pixel_data_offset += 1
-
-        # Handle row padding for the new BMP
-        new_pixel_data_offset += NEW_ROW_PADDING
-
-    return new_bmp_data
+    return _resize_96_to_32(bmp_data_mv, _IDENTITY_LUT)
 
 
 #
@@ -389,7 +423,7 @@ def resize_96x96_to_32x32(bmp_data_mv):
 #    Args:
 #    bmp_byte_array (bytes): The byte array of the BMP file, including the header.
 #    Returns:
-#    bytes: A byte array containing only the pixel data.
+#    memoryview: A view (not a copy) of the 32 x 32 pixel data. Any data after it is ignored.
 
 def strip_bmp_header(bmp_byte_array):
     BMP_HEADER_SIZE = 54  # Standard BMP header size
@@ -401,11 +435,12 @@ def strip_bmp_header(bmp_byte_array):
 
     # Strip the header and color palette
     pixel_data_start = BMP_HEADER_SIZE + PALETTE_SIZE
-    pixel_data = bmp_byte_array[pixel_data_start:]
 
     # Validate the pixel data size
-    if len(pixel_data) != 32 * 32:
-        raise ValueError("Invalid BMP file: pixel data size is not 32x32.")
+    if len(bmp_byte_array) - pixel_data_start < 32 * 32:
+        raise ValueError("Invalid BMP file: pixel data size is less than 32x32.")
+
+    pixel_data = memoryview(bmp_byte_array)[pixel_data_start:pixel_data_start + 32 * 32]
 
     # Quantize the pixel data: 0 → 0, values > 0 → 1
     #quantized_pixel_data = bytearray((1 if pixel > 0 else 0) for pixel in pixel_data)
@@ -48,6 +48,8 @@ esp.osdebug(None)   # turn off debugging log. Uncomment to show debugging log
 
 UID = const('xiao')          # authentication user
 PWD = const('Hi-Xiao-Ling')  # authentication password
+UID_B = UID.encode()         # credentials as bytes, compared with the raw request
+PWD_B = PWD.encode()
 
 cam = camera.init() # Camera
 print("Camera ready?: ", cam)
@@ -87,9 +89,16 @@ if con and cam: # WiFi and camera are ready
         cs, ca = s.accept()   # wait for client connect
         print('Request from:', ca)
         w = cs.recv(200) # blocking
-        (_, uid, pwd) = w.decode().split('\r\n')[0].split()[1].split('/')
-        # print(_, uid, pwd)
-        if not (uid==UID and pwd==PWD):
+        # request line is "GET /uid/pwd HTTP/1.1", find the path between the first two spaces
+        # of that line only (it may also end without the HTTP version)
+        line_end = w.find(b'\r\n')
+        if line_end < 0: line_end = len(w)
+        sp1 = w.find(b' ', 0, line_end)
+        sp2 = w.find(b' ', sp1 + 1, line_end)
+        if sp2 < 0: sp2 = line_end
+        (uid, _, pwd) = w[sp1 + 2:sp2].partition(b'/')
+        # print(uid, pwd)
+        if not (uid==UID_B and pwd==PWD_B):
            print('Not authenticated')
            cs.close()
            continue